@@ -8,13 +8,19 @@ API FastAPI que:
  • grava os dados em Supabase (tabela booking_ads), usando url_hash como chave.
 """
 
-import os, re, time, hashlib, datetime as dt, logging
-from typing import List, Dict
-from urllib.parse import urlsplit, urlunsplit
+import os, re, json, time, queue, hashlib, asyncio, threading, datetime as dt, logging
+from typing import List, Dict, Optional
+from contextlib import asynccontextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import urljoin
 
+import orjson
 import requests
-from bs4 import BeautifulSoup
-from fastapi import FastAPI, Query, HTTPException
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from cachetools import TTLCache
+from lxml import etree
+from fastapi import FastAPI, Query, HTTPException, BackgroundTasks
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -55,11 +61,68 @@ HEADERS = {
 }
 REQUEST_TIMEOUT = int(os.getenv("REQUEST_TIMEOUT", 30))
 MAX_CAL_MONTHS   = int(os.getenv("MAX_CAL_MONTHS", 12))
+# Cada worker uvicorn tem seu próprio BrowserPool: o host roda até
+# WORKERS × CONCURRENCY Chromes (~300-500 MB cada). Dimensione os dois juntos;
+# o total de CPUs do host (os.cpu_count) não reflete cgroups/limites do contêiner.
+WORKERS          = int(os.getenv("WORKERS", 2))             # processos uvicorn
+CONCURRENCY      = int(os.getenv("CONCURRENCY", 2))         # sessões Chrome por worker
+BROWSER_MAX_USES = int(os.getenv("BROWSER_MAX_USES", 50))   # recicla após N scrapes
+BROWSER_MAX_AGE  = int(os.getenv("BROWSER_MAX_AGE", 300))   # ... ou após N segundos
+BROWSER_WAIT     = int(os.getenv("BROWSER_WAIT", 120))      # espera máx. por uma sessão livre
+FLUSH_SECONDS    = float(os.getenv("FLUSH_SECONDS", 2))     # intervalo do lote Supabase
+FLUSH_MAX_ROWS   = int(os.getenv("FLUSH_MAX_ROWS", 100))    # ... ou ao atingir N linhas
+FLUSH_MAX_RETRIES = int(os.getenv("FLUSH_MAX_RETRIES", 3))  # lotes com falha antes de desistir
+SCRAPE_CACHE_TTL = int(os.getenv("SCRAPE_CACHE_TTL", 600))  # reaproveita scrapes recentes
+SHUTDOWN_GRACE   = int(os.getenv("SHUTDOWN_GRACE", 60))     # espera p/ scrapes no shutdown
+PENDING_TTL      = int(os.getenv("PENDING_TTL", 300))       # "pending" mais velho é órfão
+# md5 mantém as chaves já gravadas; blake2b (16 bytes) é mais rápido mas exige
+# re-scrape/migração das linhas existentes, pois muda o url_hash
+URL_HASH_ALGO    = os.getenv("URL_HASH_ALGO", "md5")
+# p/ dispensar o Selenium o calendário embutido precisa de N datas e de chegar ao
+# mesmo horizonte que ele percorreria (o mês corrente + MAX_CAL_MONTHS - 1)
+EMBEDDED_MIN_DATES = int(os.getenv("EMBEDDED_MIN_DATES", 60))
+
+# Sessão HTTP compartilhada: keep-alive + pool de conexões (1 handshake TLS por host)
+SESSION = requests.Session()
+SESSION.headers.update(HEADERS)
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=16, pool_maxsize=32,
+    max_retries=Retry(total=2, backoff_factor=0.2, status_forcelist=[502, 503, 504]),
+))
+
+class ORJSONResponse(JSONResponse):
+    """JSONResponse serializada com orjson (C), bem mais rápida que o json da stdlib."""
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # 1) cancela os jobs de Selenium ainda na fila (os que rodam terminam)
+    selenium_executor.shutdown(wait=False, cancel_futures=True)
+    # 2) espera os scrapes em andamento gravarem suas linhas, descarregando o lote
+    #    a cada segundo (eles aguardam a confirmação do flush para terminar)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + SHUTDOWN_GRACE
+    if _scrape_tasks:
+        logger.info(f"Aguardando {len(_scrape_tasks)} scrapes em andamento...")
+    while _scrape_tasks and loop.time() < deadline:
+        await asyncio.wait(set(_scrape_tasks), timeout=min(1.0, deadline - loop.time()))
+        await asyncio.to_thread(flush_to_supabase)
+    if _scrape_tasks:
+        logger.error(f"{len(_scrape_tasks)} scrapes não terminaram em {SHUTDOWN_GRACE}s")
+    # 3) só então o flush final: nada mais enfileira depois dele
+    await asyncio.to_thread(flush_to_supabase)
+    browser_pool.close()
 
 app = FastAPI(
     title="Booking Full Scraper API",
     version="1.2.0",
     description="Scrapes Booking.com listings and stores results in Supabase",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
 # ─── Habilita CORS para todas as origens ───────────────────────────────────
@@ -72,121 +135,544 @@ app.add_middleware(
 )
 
 # ─── Utilitários ──────────────────────────────────────────────────────────
+# Tudo até o primeiro "?" ou "#": dispensa urlsplit/urlunsplit num só match em C.
+# Como o urlsplit, remove \t\r\n e controles/espaços das pontas (URLs coladas).
+_CANON_RE     = re.compile(r"[^?#]*")
+_URL_NEWLINES = str.maketrans("", "", "\t\r\n")
+_URL_EDGES    = "".join(map(chr, range(0x21)))   # C0 + espaço
+
 def canonicalize_url(raw_url: str) -> str:
-    parts = urlsplit(raw_url)
-    clean = urlunsplit((parts.scheme, parts.netloc, parts.path, '', ''))
-    return clean.rstrip('/')
+    url = raw_url.translate(_URL_NEWLINES).strip(_URL_EDGES)
+    return _CANON_RE.match(url).group().rstrip('/')
 
-def url_md5(text: str) -> str:
-    return hashlib.md5(text.encode('utf-8')).hexdigest()
+_HASHERS = {
+    "md5":     lambda b: hashlib.md5(b).hexdigest(),
+    "blake2b": lambda b: hashlib.blake2b(b, digest_size=16).hexdigest(),
+}
+
+if URL_HASH_ALGO not in _HASHERS:
+    raise RuntimeError(f"URL_HASH_ALGO inválido: {URL_HASH_ALGO} (use {', '.join(_HASHERS)})")
+_url_hasher = _HASHERS[URL_HASH_ALGO]
+
+def url_hash(text: str) -> str:
+    """Chave de 32 hex chars da URL; o algoritmo vem de URL_HASH_ALGO."""
+    return _url_hasher(text.encode('utf-8'))
 
-def _get_soup(url: str) -> BeautifulSoup:
+def _get_tree(url: str) -> etree._Element:
+    # Alimenta o parser à medida que os bytes chegam: rede e parsing se sobrepõem
     try:
-        resp = requests.get(url, headers=HEADERS, timeout=REQUEST_TIMEOUT)
-        resp.raise_for_status()
-        return BeautifulSoup(resp.text, "html.parser")
+        with SESSION.get(url, stream=True, timeout=REQUEST_TIMEOUT) as resp:
+            resp.raise_for_status()
+            parser = etree.HTMLParser(recover=True, encoding=resp.encoding)
+            for chunk in resp.iter_content(65536):
+                parser.feed(chunk)
+            return parser.close()
     except Exception as e:
         logger.error(f"Falha no GET: {e}")
         raise HTTPException(status_code=502, detail=f"Erro ao buscar página: {e}")
 
-# ─── Scrapers ─────────────────────────────────────────────────────────────
-def scrape_images_and_details(url: str):
-    soup = _get_soup(url)
-    image_urls: List[str] = []
-    for img in soup.find_all("img", src=True):
-        src = img["src"]
-        if "/xdata/images/hotel/" in src:
-            full = requests.compat.urljoin(url, src)
-            if full not in image_urls:
-                image_urls.append(full)
-    desc_tag = soup.find("p", {"data-testid": "property-description"})
-    description = desc_tag.get_text(strip=True) if desc_tag else ""
-    fac_tags = soup.select('div[data-testid="property-most-popular-facilities-wrapper"] li')
-    main_facilities = [li.get_text(strip=True) for li in fac_tags]
-    logger.info(f"Imagens: {len(image_urls)} | Facilidades: {len(main_facilities)}")
-    return image_urls, description, main_facilities
+# ─── Pool de navegadores ──────────────────────────────────────────────────
+# O calendário só precisa do DOM + JS: imagens, CSS, fontes e analytics são peso morto
+_BLOCKED_CONTENT = {
+    "profile.managed_default_content_settings.images": 2,
+    "profile.managed_default_content_settings.stylesheets": 2,
+    "profile.managed_default_content_settings.fonts": 2,
+}
+_BLOCKED_URLS = [
+    "*.png", "*.jpg", "*.jpeg", "*.webp", "*.gif", "*.svg",
+    "*.woff*", "*.ttf", "*.css",
+    "*/gtm.js", "*google-analytics*", "*googletagmanager*", "*doubleclick*",
+]
 
-def scrape_calendar_prices(url: str) -> Dict[str, int]:
+def _new_driver() -> webdriver.Chrome:
     opts = Options()
     opts.binary_location = "/usr/bin/chromium"
     opts.add_argument("--headless")
     opts.add_argument("--no-sandbox")
     opts.add_argument("--disable-dev-shm-usage")
+    opts.add_experimental_option("prefs", _BLOCKED_CONTENT)
+    # driver.get() volta no DOMContentLoaded; o WebDriverWait cobre o resto
+    opts.page_load_strategy = "eager"
+    service = Service("/usr/bin/chromedriver")
+    driver = webdriver.Chrome(service=service, options=opts)
+    try:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": _BLOCKED_URLS})
+    except Exception:
+        driver.quit()
+        raise
+    return driver
 
-    driver = None
+class BrowserPool:
+    """Mantém até `size` sessões Chrome aquecidas, recicladas por uso ou idade."""
+
+    def __init__(self, size: int, max_uses: int, max_age: float):
+        self.max_uses = max_uses
+        self.max_age  = max_age
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle: "queue.Queue[webdriver.Chrome]" = queue.Queue()
+        self._born: Dict[webdriver.Chrome, float] = {}
+        self._uses: Dict[webdriver.Chrome, int] = {}
+        self._lock   = threading.Lock()   # protege _closed vs. devolução ao _idle
+        self._closed = False
+
+    def _expired(self, driver: webdriver.Chrome) -> bool:
+        return (self._uses[driver] >= self.max_uses
+                or time.monotonic() - self._born[driver] >= self.max_age)
+
+    def _discard(self, driver: webdriver.Chrome) -> None:
+        self._born.pop(driver, None)
+        self._uses.pop(driver, None)
+        try:
+            driver.quit()
+        except Exception as e:
+            logger.warning(f"Falha ao encerrar Chrome: {e}")
+
+    def acquire(self) -> webdriver.Chrome:
+        """Bloqueia até haver uma vaga e devolve uma sessão pronta para uso."""
+        if self._closed:
+            raise RuntimeError("BrowserPool encerrado")
+        if not self._slots.acquire(timeout=BROWSER_WAIT):
+            raise TimeoutError(f"Nenhuma sessão Chrome livre em {BROWSER_WAIT}s")
+        try:
+            while True:
+                try:
+                    driver = self._idle.get_nowait()
+                except queue.Empty:
+                    driver = _new_driver()
+                    self._born[driver] = time.monotonic()
+                    self._uses[driver] = 0
+                    break
+                if not self._expired(driver):
+                    break
+                self._discard(driver)
+            self._uses[driver] += 1
+            return driver
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, driver: webdriver.Chrome) -> None:
+        """Limpa a sessão e devolve ao pool (ou descarta se expirada/quebrada/encerrado)."""
+        try:
+            if not self._closed and not self._expired(driver):
+                try:
+                    driver.delete_all_cookies()
+                    driver.get("about:blank")
+                    with self._lock:
+                        if not self._closed:
+                            self._idle.put(driver)
+                            return
+                except Exception as e:   # WebDriverException, mas também urllib3/socket
+                    logger.warning(f"Sessão Chrome inválida, descartando: {e}")
+            self._discard(driver)
+        finally:
+            self._slots.release()
+
+    def close(self) -> None:
+        """Encerra as sessões ociosas; as em uso são encerradas ao serem devolvidas."""
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+browser_pool = BrowserPool(CONCURRENCY, BROWSER_MAX_USES, BROWSER_MAX_AGE)
+# Executor próprio do Selenium: scrapes na fila esperam aqui, não no executor padrão
+# do asyncio (usado por to_thread nos endpoints para Supabase/GET)
+selenium_executor = ThreadPoolExecutor(max_workers=CONCURRENCY, thread_name_prefix="selenium")
+
+# ─── Scrapers ─────────────────────────────────────────────────────────────
+# XPaths compilados uma vez; o filtro de src roda no libxml2 e devolve str puras
+_XP_HOTEL_IMAGES = etree.XPath(
+    '/descendant::img/@src[contains(., "/xdata/images/hotel/")]', smart_strings=False
+)
+_XP_DESCRIPTION = etree.XPath(
+    'normalize-space(/descendant::p[@data-testid="property-description"][1])',
+    smart_strings=False,
+)
+_XP_FACILITIES  = etree.XPath(
+    '/descendant::div[@data-testid="property-most-popular-facilities-wrapper"]//li'
+)
+_XP_TEXT        = etree.XPath('normalize-space()', smart_strings=False)
+
+def scrape_images_and_details(url: str, tree: Optional[etree._Element] = None):
+    if tree is None:
+        tree = _get_tree(url)
+    # dict.fromkeys deduplica preservando a ordem de aparição
+    image_urls: List[str] = list(dict.fromkeys(
+        src if src.startswith(("http://", "https://")) else urljoin(url, src)
+        for src in _XP_HOTEL_IMAGES(tree)
+    ))
+    description = _XP_DESCRIPTION(tree)
+    main_facilities = [t for t in map(_XP_TEXT, _XP_FACILITIES(tree)) if t]
+    logger.info(f"Imagens: {len(image_urls)} | Facilidades: {len(main_facilities)}")
+    return image_urls, description, main_facilities
+
+# O datepicker é alimentado pela query GraphQL AvailabilityCalendar; quando a
+# resposta vem serializada no HTML, ela fica num <script type="application/json">
+# com o formato {"data": {"availabilityCalendar": {"days": [{checkin, available,
+# avgPriceFormatted, ...}]}}}. Só esse caminho é aceito.
+_XP_JSON_SCRIPTS = etree.XPath(
+    '/descendant::script[@type="application/json"]/text()', smart_strings=False
+)
+_EMBEDDED_CALENDAR_PATH = ("data", "availabilityCalendar", "days")
+_ISO_DATE_RE    = re.compile(r"\d{4}-\d{2}-\d{2}")
+_NON_DIGITS_RE  = re.compile(r"\D+")
+
+def _parse_calendar_days(days: list) -> Dict[str, int]:
+    prices: Dict[str, int] = {}
+    for day in days:
+        if not isinstance(day, dict) or day.get("available") is not True:
+            continue
+        date, price_text = day.get("checkin"), day.get("avgPriceFormatted")
+        if not (isinstance(date, str) and _ISO_DATE_RE.fullmatch(date)
+                and isinstance(price_text, str)):
+            continue
+        digits = _NON_DIGITS_RE.sub("", price_text)
+        if digits and int(digits):
+            prices[date] = int(digits)
+    return prices
+
+def _calendar_horizon(today: dt.date) -> str:
+    """1º dia do último mês que o Selenium visitaria (ISO, comparável às chaves)."""
+    months = today.year * 12 + today.month - 1 + MAX_CAL_MONTHS - 1
+    return dt.date(months // 12, months % 12 + 1, 1).isoformat()
+
+def embedded_calendar_prices(tree: etree._Element,
+                             today: Optional[dt.date] = None) -> Dict[str, int]:
+    """Preços do AvailabilityCalendar embutido no HTML, se cobrir o horizonte do Selenium."""
+    horizon = _calendar_horizon(today or dt.date.today())
+    for blob in _XP_JSON_SCRIPTS(tree):
+        if '"availabilityCalendar"' not in blob:   # evita json.loads nos blobs grandes
+            continue
+        try:
+            node = json.loads(blob)
+        except ValueError:
+            continue
+        for key in _EMBEDDED_CALENDAR_PATH:
+            node = node.get(key) if isinstance(node, dict) else None
+        if not isinstance(node, list):
+            continue
+        prices = _parse_calendar_days(node)
+        last = max(prices, default="")
+        if len(prices) >= EMBEDDED_MIN_DATES and last >= horizon:
+            logger.info(f"Preços embutidos no HTML: {len(prices)} datas")
+            return dict(sorted(prices.items()))
+        logger.info(f"Calendário embutido com {len(prices)} datas até {last or '-'} "
+                    f"(horizonte {horizon}); mantendo o Selenium")
+    return {}
+
+# Lê {data: preço} de todas as células do calendário num só round-trip
+_CAL_PRICES_JS = """
+const out = {}, nonDigits = /\\D+/g;
+arguments[0].querySelectorAll("span[data-date]").forEach(cell => {
+  const p = cell.querySelector("div.a91bd87e91 span.e7362e5f34");
+  if (p) out[cell.getAttribute("data-date")] = parseInt(p.innerText.replace(nonDigits, ""), 10) || null;
+});
+return out;
+"""
+
+def scrape_calendar_prices(url: str, cancel: Optional[threading.Event] = None) -> Dict[str, int]:
+    """`cancel` interrompe o passeio pelo calendário entre etapas (ver _do_scrape)."""
+    cancel = cancel or threading.Event()
     prices: Dict[str, int] = {}
+    driver = None
     try:
-        service = Service("/usr/bin/chromedriver")
-        driver = webdriver.Chrome(service=service, options=opts)
+        if cancel.is_set():
+            return prices
+        driver = browser_pool.acquire()
+        if cancel.is_set():        # o HTML embutido pode ter chegado enquanto esperava a sessão
+            return prices
         wait = WebDriverWait(driver, 15)
         driver.get(url)
+        if cancel.is_set():
+            return prices
         wait.until(EC.element_to_be_clickable(
             (By.CSS_SELECTOR, "[data-testid='searchbox-dates-container'] button")
         )).click()
 
         for _ in range(MAX_CAL_MONTHS):
+            if cancel.is_set():
+                return prices
             cal = wait.until(EC.presence_of_element_located(
                 (By.CSS_SELECTOR, "[data-testid='searchbox-datepicker-calendar']")
             ))
-            for cell in cal.find_elements(By.CSS_SELECTOR, "span[data-date]"):
-                date = cell.get_attribute("data-date")
-                try:
-                    price_text = cell.find_element(
-                        By.CSS_SELECTOR, "div.a91bd87e91 span.e7362e5f34"
-                    ).text
-                    price = int(re.sub(r"[^\d]", "", price_text)) if price_text else None
-                    if price:
-                        prices[date] = price
-                except:
-                    continue
-            try:
-                cal.find_element(
-                    By.CSS_SELECTOR,
-                    "button[aria-label*='seguinte'], button[aria-label*='next']"
-                ).click()
-                time.sleep(0.35)
-            except:
+            # Uma única chamada ao driver por mês em vez de 2 por célula
+            month = driver.execute_script(_CAL_PRICES_JS, cal)
+            prices.update({d: p for d, p in month.items() if p})
+            # find_elements devolve [] em vez de lançar: fim do calendário sem exceção
+            btn = cal.find_elements(
+                By.CSS_SELECTOR,
+                "button[aria-label*='seguinte'], button[aria-label*='next']"
+            )
+            if not btn or btn[0].get_attribute("aria-disabled") == "true":
                 break
+            btn[0].click()
+            time.sleep(0.35)
     except Exception as e:
         logger.error(f"Erro Selenium: {e}")
     finally:
         if driver:
-            driver.quit()
+            browser_pool.release(driver)
     logger.info(f"Preços capturados: {len(prices)} datas")
     return dict(sorted(prices.items()))
 
 # ─── Persistência ─────────────────────────────────────────────────────────
-def save_to_supabase(data: dict) -> dict:
-    resp = (
-        supabase.table("booking_ads")
-                .upsert(data, on_conflict="url_hash", ignore_duplicates=False)
-                .execute()
-    )
-    if getattr(resp, "data", None):
-        logger.info("Registro salvo/atualizado.")
-        return resp.data[0]
-    raise HTTPException(status_code=500, detail="Resposta vazia do Supabase")
+# Upserts são acumulados e enviados em lote (1 round-trip por lote)
+_PENDING: Dict[str, dict] = {}          # url_hash -> payload mais recente
+_ATTEMPTS: Dict[str, int] = {}          # url_hash -> lotes que já falharam com ele
+_WAITERS: Dict[str, List[Future]] = {}  # url_hash -> quem aguarda a gravação confirmada
+_PENDING_LOCK = threading.Lock()
+_flush_timer: Optional[threading.Timer] = None
+
+def _schedule_flush() -> None:
+    """Agenda o próximo flush (chamar com _PENDING_LOCK adquirido)."""
+    global _flush_timer
+    if _flush_timer is None:
+        _flush_timer = threading.Timer(FLUSH_SECONDS, flush_to_supabase)
+        _flush_timer.daemon = True
+        _flush_timer.start()
+
+def _upsert_rows(rows: List[dict]) -> Dict[str, dict]:
+    """Grava as linhas e devolve o que o Supabase retornou (com id etc.), por url_hash."""
+    resp = (supabase.table("booking_ads")
+                    .upsert(rows, on_conflict="url_hash", ignore_duplicates=False)
+                    .execute())
+    return {r["url_hash"]: r for r in (getattr(resp, "data", None) or [])}
+
+def _resolve(rows: List[dict], saved: Dict[str, dict]) -> None:
+    """Resolve os waiters das linhas gravadas (chamar com _PENDING_LOCK adquirido)."""
+    for r in rows:
+        hsh = r["url_hash"]
+        _ATTEMPTS.pop(hsh, None)
+        if hsh not in _PENDING:            # versão nova pendente herda os waiters
+            for fut in _WAITERS.pop(hsh, []):
+                fut.set_result(saved.get(hsh, r))
+
+def flush_to_supabase() -> None:
+    global _flush_timer
+    with _PENDING_LOCK:
+        rows = list(_PENDING.values())
+        _PENDING.clear()
+        if _flush_timer:
+            _flush_timer.cancel()
+            _flush_timer = None
+    if not rows:
+        return
+    try:
+        saved = _upsert_rows(rows)
+        logger.info(f"{len(rows)} registros salvos/atualizados.")
+        with _PENDING_LOCK:
+            _resolve(rows, saved)
+        return
+    except Exception as e:
+        logger.error(f"Falha ao gravar lote de {len(rows)} registros no Supabase: {e}")
+
+    # O lote falha inteiro: as linhas voltam para a fila até FLUSH_MAX_RETRIES;
+    # na última tentativa cada uma é gravada sozinha, para que só a linha
+    # rejeitada seja descartada (e não o lote todo junto com ela).
+    last: List[dict] = []
+    with _PENDING_LOCK:
+        for r in rows:
+            hsh = r["url_hash"]
+            if hsh in _PENDING:            # chegou versão mais nova: ela recomeça
+                _ATTEMPTS.pop(hsh, None)
+                continue
+            _ATTEMPTS[hsh] = _ATTEMPTS.get(hsh, 0) + 1
+            if _ATTEMPTS[hsh] >= FLUSH_MAX_RETRIES:
+                last.append(r)
+            else:
+                _PENDING[hsh] = r
+        if _PENDING:
+            _schedule_flush()
+
+    ok: List[dict] = []
+    saved: Dict[str, dict] = {}
+    failed: List[dict] = []
+    for r in last:
+        try:
+            saved.update(_upsert_rows([r]))
+            ok.append(r)
+        except Exception as e:
+            logger.error(f"Descartado após {FLUSH_MAX_RETRIES} tentativas: {r['url_hash']} ({e})")
+            failed.append(r)
+    with _PENDING_LOCK:
+        _resolve(ok, saved)
+        gave_up = []
+        for r in failed:
+            _ATTEMPTS.pop(r["url_hash"], None)
+            if r["url_hash"] not in _PENDING:
+                gave_up.append((r, _WAITERS.pop(r["url_hash"], [])))
+    # quem aguarda (o _do_scrape) grava o status "error" uma única vez
+    for r, waiters in gave_up:
+        for fut in waiters:
+            fut.set_exception(RuntimeError(f"Falha ao gravar {r['url_hash']} no Supabase"))
+
+def save_to_supabase(data: dict) -> Future:
+    """Enfileira o upsert; o lote é gravado a cada FLUSH_SECONDS ou FLUSH_MAX_ROWS.
+
+    Devolve um Future resolvido com o registro quando o lote for confirmado pelo
+    Supabase, ou com exceção se a gravação falhar em definitivo.
+    """
+    fut: Future = Future()
+    with _PENDING_LOCK:
+        _PENDING[data["url_hash"]] = data
+        _WAITERS.setdefault(data["url_hash"], []).append(fut)
+        full = len(_PENDING) >= FLUSH_MAX_ROWS
+        if not full:
+            _schedule_flush()
+    if full:
+        flush_to_supabase()
+    return fut
+
+def upsert_now(data: dict) -> None:
+    """Upsert imediato (fora do lote), só das colunas informadas — usado para status."""
+    (supabase.table("booking_ads")
+             .upsert(data, on_conflict="url_hash", ignore_duplicates=False)
+             .execute())
+
+def fetch_ad_by_hash(url_hash: str) -> Optional[dict]:
+    r = supabase.table("booking_ads").select("*").eq("url_hash", url_hash).limit(1).execute()
+    return r.data[0] if r.data else None
+
+def fetch_fresh_ad(url_hash: str) -> Optional[dict]:
+    """Devolve o registro do Supabase se foi raspado há menos de SCRAPE_CACHE_TTL."""
+    cutoff = dt.datetime.utcnow() - dt.timedelta(seconds=SCRAPE_CACHE_TTL)
+    try:
+        r = (supabase.table("booking_ads")
+                     .select("*")
+                     .eq("url_hash", url_hash)
+                     .eq("status", "done")
+                     .gt("scraped_at", cutoff.isoformat())
+                     .limit(1)
+                     .execute())
+    except Exception as e:
+        logger.warning(f"Falha ao consultar cache no Supabase: {e}")
+        return None
+    return r.data[0] if r.data else None
+
+def has_recent_pending(url_hash: str) -> bool:
+    """True se algum worker registrou esse scraping como pending há menos de PENDING_TTL."""
+    cutoff = dt.datetime.utcnow() - dt.timedelta(seconds=PENDING_TTL)
+    try:
+        r = (supabase.table("booking_ads")
+                     .select("url_hash")
+                     .eq("url_hash", url_hash)
+                     .eq("status", "pending")
+                     .gt("scraped_at", cutoff.isoformat())
+                     .limit(1)
+                     .execute())
+    except Exception as e:
+        logger.warning(f"Falha ao consultar scraping pendente no Supabase: {e}")
+        return False
+    return bool(r.data)
+
+# ─── Cache ────────────────────────────────────────────────────────────────
+_scrape_cache: TTLCache = TTLCache(maxsize=1024, ttl=SCRAPE_CACHE_TTL)
+_in_flight: set = set()   # url_hash com scraping em andamento neste worker
+_scrape_tasks: set = set()   # tasks de _do_scrape vivas (drenadas no shutdown)
 
 # ─── Endpoints ────────────────────────────────────────────────────────────
-@app.get("/scrape", response_class=JSONResponse)
-def scrape(url: str = Query(..., description="URL completa do anúncio no Booking.com")):
-    logger.info(f"Scraping iniciado: {url}")
+async def _do_scrape(canonical: str, hsh: str) -> None:
+    task = asyncio.current_task()
+    _scrape_tasks.add(task)
+    try:
+        # Selenium começa já, em paralelo ao GET; é cancelado se o HTML trouxer os preços
+        cancel = threading.Event()
+        cal_job = asyncio.get_running_loop().run_in_executor(
+            selenium_executor, scrape_calendar_prices, canonical, cancel
+        )
+        try:
+            tree = await asyncio.to_thread(_get_tree, canonical)
+            (imgs, desc, facs), cal_prices = await asyncio.gather(
+                asyncio.to_thread(scrape_images_and_details, canonical, tree),
+                asyncio.to_thread(embedded_calendar_prices, tree),
+            )
+            if cal_prices:
+                cancel.set()
+                cal_job.cancel()
+            else:
+                try:
+                    cal_prices = await cal_job
+                except asyncio.CancelledError:
+                    if task.cancelling():
+                        raise
+                    # o job foi cancelado na fila pelo shutdown do executor
+                    raise RuntimeError("Scrape do calendário cancelado no shutdown")
+        except BaseException:
+            cancel.set()
+            cal_job.cancel()
+            raise
+        payload = {
+            "url": canonical,
+            "url_hash": hsh,
+            "status": "done",
+            "image_urls": imgs,
+            "description": desc,
+            "main_facilities": facs,
+            "calendar_prices": cal_prices,
+            "scraped_at": dt.datetime.utcnow().isoformat(),
+        }
+        # Só entra no cache (e vira "done" neste worker) depois do flush confirmado
+        saved = await asyncio.to_thread(save_to_supabase, payload)
+        _scrape_cache[hsh] = await asyncio.wrap_future(saved)
+        logger.info(f"Scraping concluído: {hsh}")
+    except Exception as e:
+        logger.error(f"Scraping falhou ({hsh}): {e}")
+        try:
+            await asyncio.to_thread(upsert_now, {"url": canonical, "url_hash": hsh, "status": "error"})
+        except Exception as e:
+            logger.error(f"Falha ao registrar erro no Supabase: {e}")
+    finally:
+        _in_flight.discard(hsh)
+        _scrape_tasks.discard(task)
+
+@app.get("/scrape", status_code=202)
+async def scrape(
+    bg: BackgroundTasks,
+    url: str = Query(..., description="URL completa do anúncio no Booking.com"),
+):
     canonical = canonicalize_url(url)
-    hsh       = url_md5(canonical)
-    imgs, desc, facs = scrape_images_and_details(canonical)
-    cal_prices       = scrape_calendar_prices(canonical)
-
-    payload = {
-        "url": canonical,
-        "url_hash": hsh,
-        "image_urls": imgs,
-        "description": desc,
-        "main_facilities": facs,
-        "calendar_prices": cal_prices,
-        "scraped_at": dt.datetime.utcnow().isoformat(),
-    }
-    row = save_to_supabase(payload)
-    return {"status":"success", "data": row}
+    hsh       = url_hash(canonical)
+    # o que vem do Supabase não entra no _scrape_cache: já gastou parte do TTL
+    # e seria servido por mais um TTL inteiro
+    cached = _scrape_cache.get(hsh) or await asyncio.to_thread(fetch_fresh_ad, hsh)
+    if cached:
+        logger.info(f"Cache hit: {hsh}")
+        return ORJSONResponse({"status":"success", "data": cached})
+
+    # _in_flight cobre este worker; o pending recente no Supabase, os demais
+    if hsh not in _in_flight:
+        _in_flight.add(hsh)   # reservado antes dos awaits
+        try:
+            busy = await asyncio.to_thread(has_recent_pending, hsh)
+            if not busy:
+                # scraped_at marca o início; o _do_scrape o regrava ao terminar
+                await asyncio.to_thread(upsert_now, {
+                    "url": canonical, "url_hash": hsh, "status": "pending",
+                    "scraped_at": dt.datetime.utcnow().isoformat(),
+                })
+        except Exception as e:
+            _in_flight.discard(hsh)
+            logger.error(f"Falha ao registrar scraping pendente: {e}")
+            raise HTTPException(status_code=500, detail="Falha ao registrar scraping no Supabase")
+        if busy:
+            _in_flight.discard(hsh)
+            logger.info(f"Scraping já em andamento em outro worker: {hsh}")
+        else:
+            logger.info(f"Scraping iniciado: {url}")
+            bg.add_task(_do_scrape, canonical, hsh)
+    return {"status":"accepted", "url_hash": hsh}
+
+@app.get("/scrape/status/{hsh}")
+async def scrape_status(hsh: str):
+    row = _scrape_cache.get(hsh) or await asyncio.to_thread(fetch_ad_by_hash, hsh)
+    if not row:
+        raise HTTPException(status_code=404, detail="Scraping não encontrado")
+    return {"status": row.get("status") or "done", "url_hash": hsh, "data": row}
 
 @app.get("/health")
 def health_check():
@@ -210,4 +696,14 @@ def get_ad(ad_id: int):
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("booking_full_api:app", host="0.0.0.0", port=int(os.getenv("PORT",8000)), reload=True)
+    # DEBUG=1: 1 worker com auto-reload; senão WORKERS (cada um com seu BrowserPool)
+    debug = os.getenv("DEBUG") == "1"
+    uvicorn.run(
+        "booking_full_api:app",
+        host="0.0.0.0",
+        port=int(os.getenv("PORT", 8000)),
+        workers=1 if debug else WORKERS,
+        loop="uvloop",
+        http="httptools",
+        reload=debug,
+    )
@@ -0,0 +1,45 @@
+import os
+
+os.environ.setdefault("SUPABASE_URL", "https://example.supabase.co")
+os.environ.setdefault("SUPABASE_KEY", "test-key")
+
+import booking_full_api as api  # noqa: E402
+
+
+class FakeDriver:
+    def __init__(self, error=None):
+        self.error = error
+        self.quit_called = False
+
+    def delete_all_cookies(self):
+        if self.error:
+            raise self.error
+
+    def get(self, url):
+        pass
+
+    def quit(self):
+        self.quit_called = True
+
+
+def test_release_discards_driver_on_any_error(monkeypatch):
+    broken = FakeDriver(ConnectionResetError("chromedriver caiu"))
+    monkeypatch.setattr(api, "_new_driver", lambda: broken)
+    pool = api.BrowserPool(1, max_uses=50, max_age=300)
+
+    pool.release(pool.acquire())
+
+    assert broken.quit_called
+    assert not pool._born and not pool._uses and pool._idle.empty()
+    assert pool._slots.acquire(blocking=False)     # a vaga voltou
+
+
+def test_release_keeps_healthy_driver_warm(monkeypatch):
+    healthy = FakeDriver()
+    monkeypatch.setattr(api, "_new_driver", lambda: healthy)
+    pool = api.BrowserPool(1, max_uses=50, max_age=300)
+
+    pool.release(pool.acquire())
+
+    assert not healthy.quit_called
+    assert pool.acquire() is healthy
@@ -0,0 +1,76 @@
+import datetime as dt
+import os
+from pathlib import Path
+
+from lxml import etree
+
+os.environ.setdefault("SUPABASE_URL", "https://example.supabase.co")
+os.environ.setdefault("SUPABASE_KEY", "test-key")
+
+import booking_full_api as api  # noqa: E402
+
+FIXTURES = Path(__file__).parent / "fixtures"
+TODAY = dt.date(2026, 11, 1)                      # o fixture cobre 2026-11-01 .. 2027-12-05
+
+
+def _tree(markup: str) -> etree._Element:
+    return etree.fromstring(markup, etree.HTMLParser())
+
+
+def _page(*blobs: str) -> etree._Element:
+    scripts = "".join(f'<script type="application/json">{b}</script>' for b in blobs)
+    return _tree(f"<html><head>{scripts}</head><body></body></html>")
+
+
+def _listing() -> etree._Element:
+    return _tree((FIXTURES / "listing_availability_calendar.html").read_text(encoding="utf-8"))
+
+
+def _calendar(days) -> etree._Element:
+    days = ",".join(
+        f'{{"checkin": "{d.isoformat()}", "available": true, "avgPriceFormatted": "R$ 500"}}'
+        for d in days
+    )
+    return _page(f'{{"data": {{"availabilityCalendar": {{"days": [{days}]}}}}}}')
+
+
+def test_listing_fixture_yields_calendar_prices():
+    prices = api.embedded_calendar_prices(_listing(), today=TODAY)
+
+    assert len(prices) >= api.EMBEDDED_MIN_DATES
+    assert prices["2026-11-01"] == 800
+    assert prices["2026-12-01"] == 1100           # "R$ 1.100"
+    assert "2026-11-06" not in prices             # available: false
+    assert list(prices) == sorted(prices)
+
+
+def test_date_keyed_counts_are_not_prices():
+    tree = _page('{"availability": {"2026-11-01": 3, "2026-11-02": 1}}')
+    assert api.embedded_calendar_prices(tree, today=TODAY) == {}
+
+
+def test_search_context_is_not_a_calendar():
+    tree = _page('{"checkin": "2026-11-01", "price": 850}')
+    assert api.embedded_calendar_prices(tree, today=TODAY) == {}
+
+
+def test_too_few_embedded_dates_keep_selenium():
+    tree = _calendar(TODAY + dt.timedelta(days=d) for d in range(5))
+    assert api.embedded_calendar_prices(tree, today=TODAY) == {}
+
+
+def test_short_embedded_horizon_keeps_selenium(monkeypatch):
+    monkeypatch.setattr(api, "MAX_CAL_MONTHS", 12)
+    three_months = _calendar(TODAY + dt.timedelta(days=d) for d in range(90))
+    assert api.embedded_calendar_prices(three_months, today=TODAY) == {}
+
+    # vale o horizonte do próprio dia da consulta: o mesmo fixture fica curto um ano depois
+    assert api.embedded_calendar_prices(_listing(), today=dt.date(2027, 11, 1)) == {}
+
+
+def test_embedded_horizon_follows_max_cal_months(monkeypatch):
+    monkeypatch.setattr(api, "MAX_CAL_MONTHS", 3)
+    tree = _calendar(TODAY + dt.timedelta(days=d) for d in range(61))   # até 2026-12-31
+    assert api.embedded_calendar_prices(tree, today=TODAY) == {}
+    tree = _calendar(TODAY + dt.timedelta(days=d) for d in range(62))   # chega a 2027-01-01
+    assert len(api.embedded_calendar_prices(tree, today=TODAY)) == 62
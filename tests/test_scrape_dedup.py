@@ -0,0 +1,94 @@
+import asyncio
+import datetime as dt
+import os
+
+import pytest
+from fastapi import BackgroundTasks
+
+os.environ.setdefault("SUPABASE_URL", "https://example.supabase.co")
+os.environ.setdefault("SUPABASE_KEY", "test-key")
+
+import booking_full_api as api  # noqa: E402
+
+URL = "https://www.booking.com/hotel/br/pousada-exemplo.html"
+
+
+class FakeTable:
+    """Tabela booking_ads em memória com o subconjunto de filtros usado pela API."""
+
+    def __init__(self):
+        self.rows = {}
+
+    def table(self, name):
+        self._filters, self._upsert = [], None
+        return self
+
+    def select(self, *cols):
+        return self
+
+    def upsert(self, row, **kwargs):
+        self._upsert = row
+        return self
+
+    def eq(self, col, value):
+        self._filters.append(lambda r: r.get(col) == value)
+        return self
+
+    def gt(self, col, value):
+        self._filters.append(lambda r: (r.get(col) or "") > value)
+        return self
+
+    def limit(self, n):
+        return self
+
+    def execute(self):
+        if self._upsert is not None:
+            row = self.rows.setdefault(self._upsert["url_hash"], {})
+            row.update(self._upsert)
+            data = [row]
+        else:
+            data = [r for r in self.rows.values() if all(f(r) for f in self._filters)]
+        return type("Resp", (), {"data": data})()
+
+
+@pytest.fixture
+def db(monkeypatch):
+    fake = FakeTable()
+    monkeypatch.setattr(api, "supabase", fake)
+    api._scrape_cache.clear()
+    yield fake
+    api._scrape_cache.clear()
+    api._in_flight.clear()
+
+
+def _request() -> BackgroundTasks:
+    bg = BackgroundTasks()
+    asyncio.run(api.scrape(bg, url=URL))
+    return bg
+
+
+def test_pending_row_from_another_worker_is_not_rescheduled(db):
+    assert len(_request().tasks) == 1
+    api._in_flight.clear()                  # outro worker: _in_flight vazio
+
+    assert _request().tasks == []
+
+
+def test_stale_pending_row_is_rescraped(db):
+    hsh = api.url_hash(api.canonicalize_url(URL))
+    old = dt.datetime.utcnow() - dt.timedelta(seconds=api.PENDING_TTL + 1)
+    db.rows[hsh] = {"url": URL, "url_hash": hsh, "status": "pending",
+                    "scraped_at": old.isoformat()}    # worker que morreu no meio
+
+    assert len(_request().tasks) == 1
+
+
+def test_fresh_row_from_supabase_is_served_but_not_cached(db):
+    hsh = api.url_hash(api.canonicalize_url(URL))
+    db.rows[hsh] = {"url": URL, "url_hash": hsh, "status": "done",
+                    "scraped_at": dt.datetime.utcnow().isoformat()}
+
+    resp = asyncio.run(api.scrape(BackgroundTasks(), url=URL))
+
+    assert resp.status_code == 200
+    assert hsh not in api._scrape_cache       # a expiração fica com o scraped_at do Supabase
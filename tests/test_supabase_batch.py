@@ -0,0 +1,150 @@
+import os
+
+import pytest
+
+os.environ.setdefault("SUPABASE_URL", "https://example.supabase.co")
+os.environ.setdefault("SUPABASE_KEY", "test-key")
+
+import booking_full_api as api  # noqa: E402
+
+
+class FakeSupabase:
+    """Imita supabase.table(...).upsert(...).execute(), registrando cada lote."""
+
+    def __init__(self):
+        self.batches = []
+        self.reject = lambda rows: False   # True -> o lote falha
+        self.during_upsert = None          # callback chamado dentro do upsert
+
+    def table(self, name):
+        return self
+
+    def upsert(self, rows, **kwargs):
+        self._rows = rows if isinstance(rows, list) else [rows]
+        return self
+
+    def execute(self):
+        rows = self._rows
+        self.batches.append([r["url_hash"] for r in rows])
+        if self.during_upsert:
+            cb, self.during_upsert = self.during_upsert, None
+            cb()
+        if self.reject(rows):
+            raise RuntimeError("rejeitado")
+        return type("Resp", (), {"data": [dict(r, id=i) for i, r in enumerate(rows, 1)]})()
+
+
+@pytest.fixture
+def db(monkeypatch):
+    fake = FakeSupabase()
+    monkeypatch.setattr(api, "supabase", fake)
+    monkeypatch.setattr(api, "FLUSH_SECONDS", 3600)    # flush só quando o teste chamar
+    monkeypatch.setattr(api, "FLUSH_MAX_RETRIES", 3)
+    yield fake
+    with api._PENDING_LOCK:
+        if api._flush_timer:
+            api._flush_timer.cancel()
+        api._flush_timer = None
+        api._PENDING.clear()
+        api._ATTEMPTS.clear()
+        api._WAITERS.clear()
+
+
+def _row(hsh, **extra):
+    return {"url": f"https://www.booking.com/hotel/br/{hsh}.html", "url_hash": hsh,
+            "status": "done", **extra}
+
+
+def test_flush_resolves_waiters(db):
+    fut = api.save_to_supabase(_row("h1"))
+    api.flush_to_supabase()
+
+    assert db.batches == [["h1"]]
+    assert fut.result(timeout=0)["url_hash"] == "h1"
+    assert not api._PENDING and not api._WAITERS
+
+
+def test_waiters_get_the_row_returned_by_supabase(db):
+    first = api.save_to_supabase(_row("h1"))
+    second = api.save_to_supabase(_row("h2"))
+    api.flush_to_supabase()
+
+    assert first.result(timeout=0)["id"] == 1     # colunas do banco, não só o payload
+    assert second.result(timeout=0)["id"] == 2
+
+
+def test_failed_batch_is_retried_and_recovers(db):
+    db.reject = lambda rows: True
+    fut = api.save_to_supabase(_row("h1"))
+    api.flush_to_supabase()
+    assert not fut.done() and "h1" in api._PENDING
+
+    db.reject = lambda rows: False
+    api.flush_to_supabase()
+    assert fut.result(timeout=0)["url_hash"] == "h1"
+    assert "h1" not in api._ATTEMPTS
+
+
+def test_gives_up_after_max_retries(db):
+    db.reject = lambda rows: True
+    fut = api.save_to_supabase(_row("h1"))
+    for _ in range(api.FLUSH_MAX_RETRIES):
+        api.flush_to_supabase()
+
+    with pytest.raises(RuntimeError):
+        fut.result(timeout=0)
+    assert not api._PENDING and not api._ATTEMPTS and not api._WAITERS
+
+
+def test_bad_row_does_not_sink_the_rest_of_its_batch(db):
+    db.reject = lambda rows: any(r["url_hash"] == "h2" for r in rows)
+    good = api.save_to_supabase(_row("h1"))
+    bad = api.save_to_supabase(_row("h2"))
+    for _ in range(api.FLUSH_MAX_RETRIES):
+        api.flush_to_supabase()
+
+    assert good.result(timeout=0)["url_hash"] == "h1"
+    with pytest.raises(RuntimeError):
+        bad.result(timeout=0)
+    assert db.batches[3:] == [["h1"], ["h2"]]        # última tentativa: uma a uma, sem regravar o erro
+
+
+def test_newer_payload_during_flush_inherits_waiters(db):
+    old = api.save_to_supabase(_row("h1", description="v1"))
+    new = {}
+    db.during_upsert = lambda: new.setdefault("fut", api.save_to_supabase(_row("h1", description="v2")))
+    api.flush_to_supabase()
+
+    assert not old.done()                            # espera a versão nova ser gravada
+    assert api._PENDING["h1"]["description"] == "v2"
+
+    api.flush_to_supabase()
+    assert old.result(timeout=0)["description"] == "v2"
+    assert new["fut"].result(timeout=0)["description"] == "v2"
+
+
+def test_shutdown_flushes_rows_of_scrapes_still_running(db, monkeypatch):
+    import asyncio
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    from lxml import etree
+
+    def slow_calendar(url, cancel):
+        time.sleep(0.3)
+        return {"2030-01-01": 100}
+
+    monkeypatch.setattr(api, "_get_tree",
+                        lambda url: etree.fromstring("<html><body/></html>", etree.HTMLParser()))
+    monkeypatch.setattr(api, "scrape_calendar_prices", slow_calendar)
+    monkeypatch.setattr(api, "selenium_executor", ThreadPoolExecutor(max_workers=1))
+
+    async def run():
+        async with api.lifespan(api.app):
+            asyncio.create_task(api._do_scrape("https://www.booking.com/hotel/br/h1.html", "h1"))
+            await asyncio.sleep(0.05)          # o scrape ainda está no Selenium
+
+    asyncio.run(run())
+    assert ["h1"] in db.batches
+    assert not api._PENDING
+    api._scrape_cache.pop("h1", None)